@@ -1,24 +1,51 @@
+import asyncio
 import gradio as gr
+import logging
+import ollama
 import os
-import subprocess
 import re
+import time
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-from patterns.algebra import AlgebraAnalyst
+# Layer progress and model setup are logged at DEBUG; set PATTERNS_DEBUG=1 to see them.
+# Only our own loggers are raised, so httpx/gradio/langchain stay at WARNING.
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+if os.getenv("PATTERNS_DEBUG"):
+    logger.setLevel(logging.DEBUG)
+    logging.getLogger("patterns").setLevel(logging.DEBUG)
+
+from patterns.algebra import AlgebraAnalyst, AlgebraBatcher
 from patterns.composition import Composer
 from patterns.code import CodeGenerator
+from patterns.config import OLLAMA_HOSTS, ModelFactory
+from patterns.unified import UnifiedAnalyst
+from patterns.utils import strip_think_tags
 
 # --- CONSTANTS ---
 GEMINI_MODELS = ["gemini-2.5-flash", "gemini-3-pro-preview", "gemini-2.5-pro"]
+OLLAMA_HOST = OLLAMA_HOSTS[0] if OLLAMA_HOSTS else os.getenv("OLLAMA_HOST", "http://localhost:11434")
+OLLAMA_MODELS_TTL = 30
+# Smaller, 4-bit models for the structural layers (L2 JSON, L3 code) when using Ollama
+L2_MODEL = os.getenv("PATTERNS_L2_MODEL", "llama3:8b-instruct-q4_K_M")
+L3_MODEL = os.getenv("PATTERNS_L3_MODEL", "llama3:8b-instruct-q4_K_M")
+# Concurrent L1 requests merged into one batched prompt; 1 disables batching (and keeps L1 streaming)
+L1_BATCH_SIZE = int(os.getenv("PATTERNS_L1_BATCH_SIZE", "1"))
 
-def strip_think_tags(text: str) -> str:
-    """Removes <think> tags."""
-    if not text: return ""
-    pattern = r"<think>.*?</think>"
-    return re.sub(pattern, "", text, flags=re.DOTALL)
+# Host -> (timestamp, models) of the last successful `get_ollama_models` query
+_ollama_models_cache = {}
+
+l1_batcher = AlgebraBatcher(max_batch_size=L1_BATCH_SIZE, window=0.05)
+
+# The "Intercalation Dynamics" header and the markdown decoration after it.
+# Searched for on its own and starting at the literal text: a leading `(.*?)` or
+# `[\*\#\s]*` makes a failed search quadratic in the length of the report.
+_INTERCAL_RE = re.compile(r"Intercalation Dynamics\s*:?[\*\#\s]*", re.IGNORECASE)
+# Inline math wrapped in backticks, e.g. `$x$`
+_INLINE_MATH_RE = re.compile(r'`(\$+.*?\$+)`')
 
 def clean_latex_formatting(text: str) -> str:
     """
@@ -33,19 +60,18 @@ def clean_latex_formatting(text: str) -> str:
     text = text.replace("[$", "(").replace("$]", ")")
     
     # 3. Robustly handle the "Intercalation Dynamics" footer
-    # Regex Breakdown:
-    # Group 1 (.*?): Capture everything (The Table) before the header
-    # Non-Capture Group (?:...): Match the header "Intercalation Dynamics" with loose formatting
-    # Group 2 (.*): Capture everything after the header (The Equation)
-    pattern = r"(?si)(.*?)(?:[\*\#\s]*Intercalation Dynamics\s*:?[\*\#\s]*)(.*)"
-    
-    match = re.search(pattern, text)
+    # Everything before the header is the table, everything after it is the equation.
+    match = _INTERCAL_RE.search(text)
     if match:
-        preamble = match.group(1).strip()
-        equation_raw = match.group(2).strip() # <--- FIXED: Was erroneously group(3)
+        # Drop the decoration in front of the header, e.g. "**" or "###"
+        end = match.start()
+        while end and (text[end - 1] in "*#" or text[end - 1].isspace()):
+            end -= 1
+        preamble = text[:end].strip()
+        equation_raw = text[match.end():].strip()
         
         # Clean formatting inside the equation
-        equation_raw = equation_raw.replace("**", "").replace("*", "")
+        equation_raw = equation_raw.replace("*", "")
         
         # Wrap in $$ if missing
         if not (equation_raw.startswith("$$") or equation_raw.startswith("\\[")):
@@ -56,19 +82,34 @@ def clean_latex_formatting(text: str) -> str:
         return f"{preamble}\n\n**Intercalation Dynamics:**\n\n{equation_section}"
 
     # 4. Fallback: simple cleanup if regex didn't match
-    text = re.sub(r'`(\$+.*?\$+)`', r'\1', text)
+    text = _INLINE_MATH_RE.sub(r'\1', text)
     
     return text
 
-def get_ollama_models():
+def get_ollama_models(host=None):
+    """
+    Lists the Ollama models pulled on `host` (default: OLLAMA_HOST).
+
+    Queries the Ollama HTTP API and caches a successful answer per host for
+    OLLAMA_MODELS_TTL seconds, so toggling the provider does not hit the
+    server every time.
+    """
+    host = host or OLLAMA_HOST
+    now = time.monotonic()
+    cached = _ollama_models_cache.get(host)
+    if cached and now - cached[0] < OLLAMA_MODELS_TTL:
+        return cached[1]
+
     try:
-        result = subprocess.run(['ollama', 'list'], capture_output=True, text=True, check=True)
-        lines = result.stdout.strip().split('\n')
-        if len(lines) <= 1: return ["llama3"] 
-        return [line.split()[0] for line in lines[1:]]
-    except:
+        response = ollama.Client(host=host).list()
+        models = [m.get("model") or m.get("name") for m in response["models"]]
+    except Exception:
         return ["Ollama Not Installed"]
 
+    if not models: models = ["llama3"]
+    _ollama_models_cache[host] = (now, models)
+    return models
+
 def update_model_choices(provider):
     if provider == "Google Gemini":
         return gr.Dropdown(choices=GEMINI_MODELS, value=GEMINI_MODELS[0], interactive=True)
@@ -76,48 +117,119 @@ def update_model_choices(provider):
         models = get_ollama_models()
         return gr.Dropdown(choices=models, value=models[0] if models else "llama3", interactive=True)
 
-def process_pattern(text, model_name):
-    if not text.strip(): return "Please enter text.", "", ""
+def layer_model(model_name, preferred, host=None):
+    """
+    Picks the model for a structural layer (L2/L3), which doesn't need the flagship model.
+    Gemini requests use the fastest Gemini model; Ollama requests use `preferred`
+    if it has been pulled on `host`, and fall back to the user's model otherwise.
+    """
+    if model_name.lower().startswith("gemini"):
+        return GEMINI_MODELS[0]
+    return preferred if preferred in get_ollama_models(host) else model_name
+
+def build_composer(model_name, l2_model, host):
+    """Creates the Layer 2 Composer; resolving its model may query Ollama."""
+    return Composer(model_name=l2_model or layer_model(model_name, L2_MODEL, host), base_url=host)
+
+def build_coder(model_name, l3_model, host, creative_code):
+    """Creates the Layer 3 CodeGenerator; only the creative mode needs a resolved model."""
+    if creative_code:
+        l3_model = l3_model or layer_model(model_name, L3_MODEL, host)
+    return CodeGenerator(model_name=l3_model or model_name, base_url=host, creative=creative_code)
+
+async def process_pattern(text, model_name, unified_mode=False, creative_code=False, l2_model=None, l3_model=None):
+    """
+    Runs the three layers, yielding (algebra, report, code) as each one progresses.
+    With unified_mode, all three layers are produced by a single LLM call.
+    With creative_code, Layer 3 is written by the LLM instead of the code template.
+    l2_model/l3_model override the models of Layers 2 and 3 (see `layer_model`).
+    """
+    if not text.strip():
+        yield "Please enter text.", "", ""
+        return
     if model_name.lower().startswith("gemini") and not os.getenv("GEMINI_API_KEY"):
-        return "Error: GOOGLE_API_KEY missing.", "", ""
+        yield "Error: GOOGLE_API_KEY missing.", "", ""
+        return
 
     algebraic_expr = ""
     math_report = ""
     pytorch_code = ""
 
-    # Layer 1
-    try:
-        print(f"--- L1: Algebra ({model_name}) ---")
-        analyst = AlgebraAnalyst(model_name=model_name)
-        algebraic_expr = strip_think_tags(analyst.analyze(text))
-    except Exception as e: return f"Error L1: {e}", "", ""
+    # Spread requests over the Ollama servers, but keep all layers of one
+    # request on the same server so they hit its already-loaded model.
+    host = None if model_name.lower().startswith("gemini") else ModelFactory.next_ollama_host()
+
+    if unified_mode:
+        yield "⏳ Analyzing...", "", ""
+        try:
+            logger.debug("--- L1-L3: Unified (%s) ---", model_name)
+            unified = await asyncio.to_thread(UnifiedAnalyst, model_name=model_name, base_url=host)
+            algebraic_expr, composition, pytorch_code = await unified.analyze(text)
+            math_report = clean_latex_formatting(Composer.format_latex_report(composition))
+        except Exception as e:
+            yield f"Error: {e}", "", ""
+            return
+        yield algebraic_expr, math_report, pytorch_code
+        return
+
+    # L2/L3 depend on L1's output, but picking and building their models does not:
+    # do it in worker threads while the L1 call is in flight.
+    composer_task = asyncio.create_task(asyncio.to_thread(build_composer, model_name, l2_model, host))
+    coder_task = asyncio.create_task(asyncio.to_thread(build_coder, model_name, l3_model, host, creative_code))
 
-    # Layer 2
     try:
-        print("--- L2: Composition ---")
-        composer = Composer(model_name=model_name)
-        composition = composer.compose(algebraic_expr)
-        
-        if isinstance(composition, dict):
+        # Layer 1
+        try:
+            logger.debug("--- L1: Algebra (%s) ---", model_name)
+            analyst = await asyncio.to_thread(AlgebraAnalyst, model_name=model_name, base_url=host)
+            if L1_BATCH_SIZE > 1:
+                algebraic_expr = strip_think_tags(await l1_batcher.submit(analyst, text))
+                yield algebraic_expr, "", ""
+            else:
+                async for partial in analyst.analyze_stream(text):
+                    algebraic_expr = strip_think_tags(partial, streaming=True)
+                    yield algebraic_expr, "", ""
+        except Exception as e:
+            yield f"Error L1: {e}", "", ""
+            return
+
+        # Layer 2
+        yield algebraic_expr, "⏳ Composing...", ""
+        try:
+            composer = await composer_task
+            logger.debug("--- L2: Composition (%s) ---", composer.model_name)
+            composition = await composer.compose(algebraic_expr)
             raw = composer.format_latex_report(composition)
             math_report = clean_latex_formatting(raw)
-        else:
-            math_report = f"Error parsing JSON: {composition}"
-            
-    except Exception as e: return algebraic_expr, f"Error L2: {e}", ""
+        except Exception as e:
+            yield algebraic_expr, f"Error L2: {e}", ""
+            return
 
-    # Layer 3
-    try:
-        print("--- L3: Code Gen ---")
-        coder = CodeGenerator(model_name=model_name)
-        pytorch_code = strip_think_tags(coder.generate_code(composition))
-    except Exception as e: return algebraic_expr, math_report, f"Error L3: {e}"
+        # Layer 3
+        yield algebraic_expr, math_report, "⏳ Generating code..."
+        try:
+            coder = await coder_task
+            logger.debug("--- L3: Code Gen (%s) ---", coder.model_name)
+            async for partial in coder.generate_code_stream(composition):
+                pytorch_code = strip_think_tags(partial, streaming=True)
+                yield algebraic_expr, math_report, pytorch_code
+        except Exception as e:
+            yield algebraic_expr, math_report, f"Error L3: {e}"
+    finally:
+        # On an early return or when Gradio closes the generator, stop the
+        # builders still running and consume the result of finished ones, so a
+        # builder error isn't reported as "Task exception was never retrieved".
+        for task in (composer_task, coder_task):
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()
 
-    return algebraic_expr, math_report, pytorch_code
+# Queried once at startup for the initial dropdown
+OLLAMA_MODELS = get_ollama_models()
 
 # --- CSS: HIGH VISIBILITY ---
 custom_css = """
-<style>
 .container { max-width: 1100px; margin: auto; }
 h1 { text-align: center; color: #2d3748; }
 
@@ -138,7 +250,9 @@ h1 { text-align: center; color: #2d3748; }
     --prose-body: #000000 !important;
 }
 
-#math_output * {
+/* Explicit elements rather than `*`, so MathJax/KaTeX DOM updates don't restyle the whole subtree */
+#math_output p, #math_output li, #math_output h1, #math_output h2, #math_output h3,
+#math_output strong, #math_output em, #math_output .katex {
     color: #000000 !important;
 }
 
@@ -167,13 +281,10 @@ h1 { text-align: center; color: #2d3748; }
     font-family: inherit;
     font-size: 100%;
 }
-</style>
 """
 
 with gr.Blocks(title="Patterns Engine") as demo:
     
-    gr.HTML(custom_css)
-    
     with gr.Column(elem_classes=["container"]):
         gr.Markdown("# Patterns: Cognitive Transpiler")
         
@@ -181,8 +292,9 @@ with gr.Blocks(title="Patterns Engine") as demo:
             txt_input = gr.Textbox(label="Context", lines=4)
             with gr.Column():
                 provider = gr.Radio(["Ollama (Local)", "Google Gemini"], value="Ollama (Local)", label="Provider")
-                models = get_ollama_models()
-                model = gr.Dropdown(choices=models, value=models[0], label="Model")
+                model = gr.Dropdown(choices=OLLAMA_MODELS, value=OLLAMA_MODELS[0], label="Model")
+                unified = gr.Checkbox(label="Single LLM call (faster on short inputs)", value=False)
+                creative = gr.Checkbox(label="Creative code (LLM-written Layer 3)", value=False)
                 btn = gr.Button("Analyze", variant="primary")
 
         gr.Markdown("---")
@@ -205,7 +317,8 @@ with gr.Blocks(title="Patterns Engine") as demo:
         out3 = gr.Code(language="python")
 
     provider.change(update_model_choices, inputs=[provider], outputs=[model])
-    btn.click(process_pattern, inputs=[txt_input, model], outputs=[out1, out2, out3])
+    btn.click(process_pattern, inputs=[txt_input, model, unified, creative], outputs=[out1, out2, out3], api_name="run",
+              concurrency_limit=max(1, len(OLLAMA_HOSTS), L1_BATCH_SIZE))
 
 if __name__ == "__main__":
-    demo.launch()
\ No newline at end of file
+    demo.launch(css=custom_css)
\ No newline at end of file
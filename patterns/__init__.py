@@ -1,3 +1,4 @@
 from .algebra import AlgebraAnalyst
 from .composition import Composer
-from .code import CodeGenerator
\ No newline at end of file
+from .code import CodeGenerator
+from .unified import UnifiedAnalyst
\ No newline at end of file
@@ -1,7 +1,11 @@
-from langchain_core.prompts.prompt import PromptTemplate
+import asyncio
+import re
+from langchain_core.prompts import ChatPromptTemplate
+from .cache import ainvoke_cached, astream_cached, make_key, response_cache
 from .config import ModelFactory
+from .utils import strip_think_tags
 
-ALGEBRA_SYSTEM_PROMPT = f"""
+ALGEBRA_SYSTEM_PROMPT = """
 You are an expert in algebraic computational modelling.
 
 Your objective is to deconstruct natural language into high-fidelity, complex algebraic "molecules" representing cognitive dynamics.
@@ -38,21 +42,121 @@ Your objective is to deconstruct natural language into high-fidelity, complex al
   *Output*: `100(Ne ~ Fe)`
 
 ### INSTRUCTIONS:
-Analyze the text below. Look for layers of motivation, conflict, and resulting behavior. Construct a complex algebraic expression that captures the *nuance*, *intensity* (mass), and *speed* (acceleration) of the psyche described.
+Analyze the text given by the user. Look for layers of motivation, conflict, and resulting behavior. Construct a complex algebraic expression that captures the *nuance*, *intensity* (mass), and *speed* (acceleration) of the psyche described.
 
 **Output ONLY the final algebraic expression string.**
-
-Text: {{text}}
 """
 
+# Human message for several texts at once; the system prompt stays the same.
+BATCH_INSTRUCTIONS = """You will receive {count} numbered texts. Analyze each one independently.
+
+{numbered}
+
+Output one line per text, in order, formatted exactly as "Output N: <expression>"."""
+
+_BATCH_OUTPUT_RE = re.compile(r"^\s*\**Output\s+(\d+)\**\s*:\s*(.+?)\s*$", re.MULTILINE)
+
 class AlgebraAnalyst:
-    def __init__(self, model_name="llama3"):
-        self.llm = ModelFactory.get_model(model_name=model_name, temperature=0.8)
-        self.prompt = PromptTemplate(
-            template=ALGEBRA_SYSTEM_PROMPT,
-            input_variables=["text"]
-        )
+    def __init__(self, model_name="llama3", base_url=None):
+        self.model_name = model_name
+        self.base_url = base_url
+        self.temperature = 0.8
+        self.llm = ModelFactory.get_model(model_name=model_name, temperature=self.temperature, base_url=base_url)
+        self.prompt = ChatPromptTemplate.from_messages([
+            ("system", ALGEBRA_SYSTEM_PROMPT),
+            ("human", "Text: {text}")
+        ])
         self.chain = self.prompt | self.llm
+        self.batch_prompt = ChatPromptTemplate.from_messages([
+            ("system", ALGEBRA_SYSTEM_PROMPT),
+            ("human", "{batch}")
+        ])
+        self.batch_chain = self.batch_prompt | self.llm
+
+    async def analyze(self, text):
+        key = make_key(ALGEBRA_SYSTEM_PROMPT, text, self.model_name, self.temperature)
+        return await ainvoke_cached(self.chain, {"text": text}, key)
+
+    def analyze_stream(self, text):
+        """Streams the expression, yielding the text generated so far."""
+        key = make_key(ALGEBRA_SYSTEM_PROMPT, text, self.model_name, self.temperature)
+        return astream_cached(self.chain, {"text": text}, key)
+
+    async def analyze_batch(self, texts):
+        """
+        Analyzes several texts with a single numbered prompt.
+
+        Cached texts are skipped; any text whose output is missing from the
+        batched response is analyzed on its own.
+
+        Returns:
+            The raw expressions, in the same order as `texts`.
+        """
+        keys = [make_key(ALGEBRA_SYSTEM_PROMPT, t, self.model_name, self.temperature) for t in texts]
+        results = [response_cache.get(key) for key in keys]
+        pending = [i for i, result in enumerate(results) if result is None]
+        if len(pending) == 1:
+            results[pending[0]] = await self.analyze(texts[pending[0]])
+        elif pending:
+            numbered = "\n".join(f"Text {n}: {texts[i]}" for n, i in enumerate(pending, start=1))
+            batch = BATCH_INSTRUCTIONS.format(count=len(pending), numbered=numbered)
+            raw_output = strip_think_tags((await self.batch_chain.ainvoke({"batch": batch})).content)
+            outputs = {int(n): expr for n, expr in _BATCH_OUTPUT_RE.findall(raw_output)}
+            for n, i in enumerate(pending, start=1):
+                if n in outputs:
+                    results[i] = outputs[n]
+                    response_cache.set(keys[i], outputs[n])
+
+            missing = [i for i in pending if results[i] is None]
+            retried = await asyncio.gather(*(self.analyze(texts[i]) for i in missing))
+            for i, result in zip(missing, retried):
+                results[i] = result
+        return results
+
+
+class AlgebraBatcher:
+    """
+    Merges concurrent Layer 1 requests into batched prompts.
+
+    Requests for the same model and server that arrive within `window`
+    seconds of the first one are sent together through
+    AlgebraAnalyst.analyze_batch, up to `max_batch_size` per call.
+    """
+
+    def __init__(self, max_batch_size=8, window=0.05):
+        self.max_batch_size = max_batch_size
+        self.window = window
+        self._pending = {}
+        self._tasks = set()
+
+    async def submit(self, analyst, text):
+        """Queues `text` for the next batch and returns its raw expression."""
+        loop = asyncio.get_running_loop()
+        key = (analyst.model_name, analyst.base_url)
+        future = loop.create_future()
+        batch = self._pending.setdefault(key, [])
+        batch.append((text, future))
+        if len(batch) >= self.max_batch_size:
+            self._flush(key, analyst, batch)
+        elif len(batch) == 1:
+            loop.call_later(self.window, self._flush, key, analyst, batch)
+        return await future
+
+    def _flush(self, key, analyst, batch):
+        # A batch that filled up early was already flushed; its timer finds a newer batch or none
+        if self._pending.get(key) is not batch:
+            return
+        del self._pending[key]
+        task = asyncio.ensure_future(self._run(analyst, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
 
-    def analyze(self, text):
-        return self.chain.invoke({"text":text}).content
\ No newline at end of file
+    async def _run(self, analyst, batch):
+        try:
+            results = await analyst.analyze_batch([text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done(): future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done(): future.set_result(result)
@@ -0,0 +1,160 @@
+import re
+
+# Function -> (name, objective class, LaTeX formula, description), as in COMPOSER_SYSTEM_PROMPT
+FUNCTIONS = {
+    "Se": ("Extraverted Sensing", "ExplorationObjective", r"\mathcal{H}(\pi(a|s))", "Maximize Entropy"),
+    "Si": ("Introverted Sensing", "GatheringObjective", r"e^{-||s - \mu||}", "Minimize Distance to Centroid"),
+    "Ne": ("Extraverted Intuition", "ExtrapolationObjective", r"e^{||s - \mu||}", "Maximize Distance / Novelty"),
+    "Ni": ("Introverted Intuition", "InterpolationObjective", r"\text{proj}_{\vec{v}}(s)", "Trajectory Alignment"),
+    "Te": ("Extraverted Thinking", "ExploitationObjective", r"\mathbb{E}[V(s)]", "Maximize Value"),
+    "Ti": ("Introverted Thinking", "ContrastObjective", r"|d(s, a) - d(s, b)|", "Maximize Discrimination"),
+    "Fe": ("Extraverted Feeling", "IntegrationObjective", r"\mathcal{H} + \alpha V(s)", "Balance Entropy & Value"),
+    "Fi": ("Introverted Feeling", "SelectionObjective", r"e^{-d(s, s_{t-1})}", "Temporal Consistency"),
+}
+
+# Operator -> schedule logic
+OPERATORS = {
+    "~": "Orbital",
+    "->": "Drag",
+    "→": "Drag",
+    "|": "Stochastic Switching",
+    "oo": "Adversarial",
+    "+": "Linear",
+}
+
+_TOKEN_RE = re.compile(
+    r"\s*(?:(?P<number>\d+(?:\.\d+)?)|(?P<function>[SNTF][ie])|(?P<op>->|→|~|\||oo|\+)|(?P<paren>[()]))"
+)
+
+
+class AlgebraSyntaxError(ValueError):
+    """Raised when a string is not a valid Cognitive Algebra expression."""
+
+
+def _tokenize(expression):
+    tokens = []
+    pos = 0
+    expression = expression.rstrip()
+    while pos < len(expression):
+        match = _TOKEN_RE.match(expression, pos)
+        if not match:
+            raise AlgebraSyntaxError(f"Unexpected input at position {pos}: {expression[pos:pos + 10]!r}")
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        pos = match.end()
+    return tokens
+
+
+class _Parser:
+    """
+    Recursive descent parser. All operators share one precedence level and
+    associate to the left; parentheses group.
+
+        expr := term (OPERATOR term)*
+        term := NUMBER? "(" expr ")" | NUMBER? FUNCTION
+
+    A number before "(" is an acceleration, a number before a function is its mass.
+    Nodes are ("func", name, mass), ("group", acceleration, node) and
+    ("op", logic, left, right).
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def parse(self):
+        node = self._expr()
+        if self.pos != len(self.tokens):
+            raise AlgebraSyntaxError(f"Unexpected token {self.tokens[self.pos][1]!r}")
+        return node
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def _next(self):
+        token = self._peek()
+        self.pos += 1
+        return token
+
+    def _expr(self):
+        node = self._term()
+        while self._peek()[0] == "op":
+            logic = OPERATORS[self._next()[1]]
+            node = ("op", logic, node, self._term())
+        return node
+
+    def _term(self):
+        number = None
+        if self._peek()[0] == "number":
+            number = float(self._next()[1])
+
+        kind, value = self._next()
+        if value == "(":
+            inner = self._expr()
+            if self._next()[1] != ")":
+                raise AlgebraSyntaxError("Missing closing parenthesis")
+            return ("group", number, inner)
+        if kind == "function":
+            return ("func", value, number)
+        raise AlgebraSyntaxError(f"Expected a function or '(', got {value!r}")
+
+
+def _top_logic(node):
+    """Schedule logic of the outermost operator, or None for a lone function."""
+    while node[0] == "group":
+        node = node[2]
+    return node[1] if node[0] == "op" else None
+
+
+def _walk(node):
+    """Yields every node in pre-order."""
+    yield node
+    if node[0] == "group":
+        yield from _walk(node[2])
+    elif node[0] == "op":
+        yield from _walk(node[2])
+        yield from _walk(node[3])
+
+
+def parse_algebra(expression):
+    """
+    Builds the Layer 2 composition for an algebra expression without an LLM.
+
+    Args:
+        expression: A Cognitive Algebra string, e.g. `10((Fi oo Fe) -> Te) ~ Si`.
+
+    Returns:
+        A dict with the same fields as the Composer's JSON "Score".
+
+    Raises:
+        AlgebraSyntaxError: If the expression does not follow the grammar.
+    """
+    expression = expression.strip().strip("`").strip()
+    if not expression:
+        raise AlgebraSyntaxError("Empty expression")
+    tree = _Parser(_tokenize(expression)).parse()
+
+    logic = _top_logic(tree) or "Linear"
+    nodes = list(_walk(tree))
+    accelerations = [n[1] for n in nodes if n[0] == "group" and n[1] is not None]
+    functions = [n for n in nodes if n[0] == "func"]
+
+    score = []
+    for i, (_, symbol, mass) in enumerate(functions, start=1):
+        name, objective, formula, description = FUNCTIONS[symbol]
+        score.append({
+            "voice": f"Voice {i} ({name})",
+            "symbol": objective,
+            "mass": mass if mass is not None else 1.0,
+            "formula": formula,
+            "description": description,
+        })
+
+    descriptions = ", ".join(track["description"] for track in score)
+    return {
+        "original_expression": expression,
+        "schedule_logic": logic,
+        "global_frequency": accelerations[0] if accelerations else 1.0,
+        "score": score,
+        "math_narrative": f"{logic} schedule over {descriptions}.",
+    }
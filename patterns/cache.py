@@ -0,0 +1,113 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_key(template, text, model_name, temperature):
+    """
+    Builds the cache key for one LLM call.
+
+    Args:
+        template: The system prompt template the chain was built from.
+        text: The dynamic input sent alongside the template.
+        model_name: The model the chain runs on.
+        temperature: The sampling temperature of the model.
+
+    Returns:
+        A sha256 hex digest identifying the call.
+    """
+    raw = template + text + model_name + str(temperature)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    LRU cache with a TTL for raw LLM responses.
+
+    Entries live in memory; if `directory` is given they are also written
+    through to a `diskcache.Cache` so they survive restarts.
+    """
+
+    def __init__(self, maxsize=512, ttl=3600, directory=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+        if directory:
+            import diskcache
+            self._disk = diskcache.Cache(directory)
+
+    def get(self, key):
+        """Returns the cached response for `key`, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if time.monotonic() - stored_at < self.ttl:
+                    self._entries.move_to_end(key)
+                    return value
+                del self._entries[key]
+
+        if self._disk is not None:
+            value = self._disk.get(key)
+            if value is not None:
+                self._remember(key, value)
+                return value
+        return None
+
+    def set(self, key, value):
+        """Stores `value` under `key`, evicting the least recently used entry if full."""
+        self._remember(key, value)
+        if self._disk is not None:
+            self._disk.set(key, value, expire=self.ttl)
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+# Shared by all layers; set PATTERNS_CACHE_DIR to persist across sessions.
+response_cache = ResponseCache(directory=os.getenv("PATTERNS_CACHE_DIR"))
+
+
+async def astream_cached(chain, inputs, key):
+    """
+    Streams a chain's output, yielding the text generated so far.
+
+    A cached response is yielded whole; a stream that runs to completion
+    is stored in the cache under `key`.
+    """
+    content = response_cache.get(key)
+    if content is not None:
+        yield content
+        return
+
+    content = ""
+    async for chunk in chain.astream(inputs):
+        content += chunk.content
+        yield content
+    response_cache.set(key, content)
+
+
+async def ainvoke_cached(chain, inputs, key, parse=None):
+    """
+    Runs a chain once and returns its output, or the cached response for `key`.
+
+    If `parse` is given it is applied to the raw text and its result is
+    returned; the response is only cached once `parse` succeeds, so a reply
+    that fails to parse is not replayed on the next attempt.
+    """
+    content = response_cache.get(key)
+    if content is not None:
+        return parse(content) if parse else content
+
+    content = (await chain.ainvoke(inputs)).content
+    result = parse(content) if parse else content
+    response_cache.set(key, content)
+    return result
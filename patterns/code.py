@@ -1,6 +1,9 @@
 import json
-from langchain_core.prompts.prompt import PromptTemplate
+import jinja2
+from langchain_core.prompts import ChatPromptTemplate
+from .cache import ainvoke_cached, astream_cached, make_key
 from .config import ModelFactory
+from .utils import strip_code_fences, strip_think_tags
 
 CODING_SYSTEM_PROMPT = """
 You are an expert Reinforcement Learning Engineer and Computational Psychologist.
@@ -13,7 +16,7 @@ You are extending a library called `capo.py`.
 - **Available Objectives**: `ExplorationObjective`, `ExploitationObjective`, `GatheringObjective`, `ExtrapolationObjective`, `InterpolationObjective`, `ContrastObjective`, `IntegrationObjective`, `SelectionObjective`.
 
 ### INPUT DATA (The Harmonic Schedule):
-You will receive a JSON object containing:
+The user will send a JSON object containing:
 1. `score`: A list of objectives. Each has a `symbol` (class name), `mass` (base weight), and `voice` (name).
 2. `schedule_logic`: The dynamics type ("Orbital", "Drag", "Stochastic Switching", "Adversarial", "Linear").
 3. `global_frequency`: A float representing acceleration/speed.
@@ -62,41 +65,151 @@ You will receive a JSON object containing:
 - Output **ONLY** valid Python code.
 - Do not use Markdown backticks.
 - Ensure logic handles cases where `score` has 1 or multiple items.
+"""
+
+# Deterministic rendering of the same AlgebraAgent the prompt above describes.
+AGENT_PY_TEMPLATE = """import math
+import random
+
+from capo import PPOAgent, ObjectiveConfig{% for symbol in symbols %}, {{ symbol }}{% endfor %}
+
+
+
+# Harmonic Schedule: {{ logic }}
+# Expression: {{ expression }}
+SCORE = [
+{% for track in score %}
+    {"voice": {{ track.voice | py }}, "symbol": {{ track.symbol | py }}, "mass": {{ track.mass | py }}},
+{% endfor %}
+]
 
-### INPUT JSON:
-{schedule_json}
+
+class AlgebraAgent(PPOAgent):
+    def __init__(self, config):
+        self.global_frequency = {{ freq | py }}
+        self.step_count = 0
+        self.base_weights = {}
+        self.objective_configs = {}
+        for item in SCORE:
+            self.base_weights[item["voice"]] = item["mass"]
+            self.objective_configs[item["voice"]] = ObjectiveConfig(
+                name=item["voice"],
+                enabled=True,
+                weight=item["mass"],
+                mode={{ logic | py }},
+                metadata={"role": item["voice"], "math_symbol": item["symbol"]},
+            )
+        config["objective_configs"] = self.objective_configs
+        super().__init__(config)
+
+    def get_action(self, state):
+        self.step_count += 1
+{% if logic == "Orbital" %}
+        # Orbital: weights oscillate, alternating sin/cos phases between objectives
+        phase = self.step_count * self.global_frequency
+        for i, name in enumerate(self.objective_configs):
+            wave = math.sin(phase) if i % 2 == 0 else math.cos(phase)
+            self.objective_configs[name].weight = self.base_weights[name] * wave
+{% elif logic == "Drag" %}
+        # Drag: the first objective decays exponentially while the others grow
+        decay = math.exp(-self.step_count * self.global_frequency)
+        for i, name in enumerate(self.objective_configs):
+            factor = decay if i == 0 else 1 - decay
+            self.objective_configs[name].weight = self.base_weights[name] * factor
+{% elif logic == "Stochastic Switching" %}
+        # Stochastic Switching: objectives toggle on/off with probability `global_frequency`
+        for name in self.objective_configs:
+            self.objective_configs[name].enabled = random.random() < self.global_frequency
+{% elif logic == "Adversarial" %}
+        # Adversarial: the secondary objectives pull against the first
+        for i, name in enumerate(self.objective_configs):
+            sign = 1 if i == 0 else -1
+            self.objective_configs[name].weight = sign * self.base_weights[name]
+{% else %}
+        # Linear: constant weights
+{% endif %}
+        return super().get_action(state)
+
+
+if __name__ == "__main__":
+    config = {
+        "state_dim": 8,
+        "action_dim": 4,
+        "hidden_dim": 64,
+        "lr": 3e-4,
+        "gamma": 0.99,
+        "clip_epsilon": 0.2,
+    }
+    agent = AlgebraAgent(config)
+    print(f"AlgebraAgent loaded: {{ logic }} schedule with {len(agent.objective_configs)} objective(s)")
 """
 
+_template_env = jinja2.Environment(trim_blocks=True, lstrip_blocks=True, keep_trailing_newline=True)
+# Python literal for a template value; json.dumps gives double-quoted, escaped strings
+_template_env.filters["py"] = lambda value: json.dumps(value) if isinstance(value, str) else repr(value)
+_AGENT_TEMPLATE = _template_env.from_string(AGENT_PY_TEMPLATE)
+
 class CodeGenerator:
-    def __init__(self, model_name="llama3"):
-        # Temperature 0.2 allows for creative coding solutions while sticking to the strict API
-        self.llm = ModelFactory.get_model(model_name=model_name, temperature=0.8)
-        self.prompt = PromptTemplate(
-            template=CODING_SYSTEM_PROMPT,
-            input_variables=["schedule_json"]
+    def __init__(self, model_name="llama3", base_url=None, creative=False):
+        """
+        By default the code is rendered from AGENT_PY_TEMPLATE without an LLM.
+        With creative=True it is written by the LLM from CODING_SYSTEM_PROMPT instead.
+        """
+        self.model_name = model_name
+        self.creative = creative
+        # Temperature 0.1 keeps the code close to the strict API and makes it cacheable
+        self.temperature = 0.1
+        if creative:
+            self.llm = ModelFactory.get_model(model_name=model_name, temperature=self.temperature, base_url=base_url)
+            self.prompt = ChatPromptTemplate.from_messages([
+                ("system", CODING_SYSTEM_PROMPT),
+                ("human", "INPUT JSON:\n{schedule_json}")
+            ])
+            self.chain = self.prompt | self.llm
+
+    def render_code(self, composition):
+        """
+        Renders the PyTorch code for the Layer 2 composition from AGENT_PY_TEMPLATE.
+        """
+        score = composition.get("score", [])
+        # Unique objective classes, in order of appearance, for the import line
+        symbols = [s for s in dict.fromkeys(t["symbol"] for t in score) if s.isidentifier()]
+        return _AGENT_TEMPLATE.render(
+            score=score,
+            symbols=symbols,
+            logic=composition.get("schedule_logic", "Linear"),
+            freq=composition.get("global_frequency", 1.0),
+            expression=" ".join(str(composition.get("original_expression", "")).split()),
         )
-        self.chain = self.prompt | self.llm
 
-    def generate_code(self, composition):
+    async def generate_code(self, composition):
         """
-        Generates the PyTorch code using an LLM Chain based on the Layer 2 composition JSON.
+        Generates the PyTorch code based on the Layer 2 composition JSON.
         """
+        if not self.creative:
+            return self.render_code(composition)
+
         # Serialize the complex dictionary to a JSON string
         schedule_json = json.dumps(composition, indent=2)
         
-        # Run the chain
-        raw_code = self.chain.invoke({"schedule_json": schedule_json}).content
-        
-        # Clean up output
-        return raw_code 
-
-    def _clean_output(self, text):
-        """Removes markdown formatting if present."""
-        text = text.strip()
-        if text.startswith("```python"):
-            text = text[9:]
-        elif text.startswith("```"):
-            text = text[3:]
-        if text.endswith("```"):
-            text = text[:-3]
-        return text.strip()
\ No newline at end of file
+        # Run the chain, unless this exact schedule was already generated
+        key = make_key(CODING_SYSTEM_PROMPT, schedule_json, self.model_name, self.temperature)
+        return await ainvoke_cached(self.chain, {"schedule_json": schedule_json}, key, parse=self._clean_output)
+
+    async def generate_code_stream(self, composition):
+        """
+        Streams the PyTorch code for the Layer 2 composition, yielding the code generated so far.
+        """
+        if not self.creative:
+            yield self.render_code(composition)
+            return
+
+        schedule_json = json.dumps(composition, indent=2)
+        key = make_key(CODING_SYSTEM_PROMPT, schedule_json, self.model_name, self.temperature)
+        async for partial in astream_cached(self.chain, {"schedule_json": schedule_json}, key):
+            yield self._clean_output(partial, streaming=True)
+
+    @staticmethod
+    def _clean_output(text, streaming=False):
+        """Removes think tags and markdown formatting if present."""
+        return strip_code_fences(strip_think_tags(text, streaming=streaming))
@@ -1,7 +1,10 @@
-import json
-import re
-from langchain_core.prompts.prompt import PromptTemplate
+from typing import List, Literal
+from langchain_core.prompts import ChatPromptTemplate
+from pydantic import BaseModel
+from .algebra_parser import AlgebraSyntaxError, parse_algebra
+from .cache import ainvoke_cached, make_key
 from .config import ModelFactory
+from .utils import strip_code_fences, strip_think_tags
 COMPOSER_SYSTEM_PROMPT = """
 You are a Mathematical Physicist and Harmonic Composer for a Computational Psychology engine.
 Your task is to translate a "Cognitive Algebra" expression into a "Mathematical Schedule" of optimization objectives for a Reinforcement Learning agent.
@@ -30,13 +33,11 @@ Your task is to translate a "Cognitive Algebra" expression into a "Mathematical
    - **Acceleration** (number *outside* parens, e.g., `40(...)`): Becomes the `frequency` or `rate` of the interaction.
 
 ### TASK:
-Analyze the Input Algebra. Return a JSON object describing the "Score".
-
-**Input Algebra**: {algebra}
+Analyze the Input Algebra given by the user. Return a JSON object describing the "Score".
 
 ### OUTPUT FORMAT (Strict JSON):
 {{
-    "original_expression": "{algebra}",
+    "original_expression": "<the Input Algebra, verbatim>",
     "schedule_logic": "Orbital" | "Drag" | "Stochastic Switching" | "Linear" | "Adversarial",
     "global_frequency": <float from acceleration coefficient, default 1.0>,
     "score": [
@@ -54,65 +55,60 @@ Analyze the Input Algebra. Return a JSON object describing the "Score".
 """
 
 
-def strip_think_tags(text: str) -> str:
-    """
-    Removes <think>...</think> tags and their content from a string.
+class ScoreItem(BaseModel):
+    voice: str
+    symbol: str
+    mass: float
+    formula: str
+    description: str
+
 
-    Args:
-        text: The input string that may contain think tags.
+class ComposerSchema(BaseModel):
+    """The "Score" JSON the Composer asks the LLM for."""
+    original_expression: str
+    schedule_logic: Literal["Orbital", "Drag", "Stochastic Switching", "Linear", "Adversarial"]
+    global_frequency: float = 1.0
+    score: List[ScoreItem]
+    math_narrative: str
 
-    Returns:
-        A new string with all think tags and their inner content removed.
-    """
-    pattern = r"<think>.*?</think>"
-    return re.sub(pattern, "", text, flags=re.DOTALL)
 
 class Composer:
-    def __init__(self, model_name="llama3"):
+    def __init__(self, model_name="llama3", base_url=None):
+        self.model_name = model_name
         # Temperature 0.1 ensures strict adherence to the JSON format
-        self.llm = ModelFactory.get_model(model_name=model_name, temperature=0.8)
-        self.prompt = PromptTemplate(
-            template=COMPOSER_SYSTEM_PROMPT,
-            input_variables=["algebra"]
-        )
-        print(self.prompt)
+        self.temperature = 0.1
+        # JSON mode constrains decoding to a JSON object, so the output always parses
+        self.llm = ModelFactory.get_model(model_name=model_name, temperature=self.temperature, json_mode=True, base_url=base_url)
+        self.prompt = ChatPromptTemplate.from_messages([
+            ("system", COMPOSER_SYSTEM_PROMPT),
+            ("human", "Input Algebra: {algebra}")
+        ])
         self.chain = self.prompt | self.llm
 
 
-    def compose(self, algebra_str):
-        """
-        Runs the LLM chain to generate the JSON composition from the algebra string.
+    async def compose(self, algebra_str):
         """
-        raw_output = self.chain.invoke({"algebra": algebra_str}).content
-        raw_output = strip_think_tags(raw_output) 
-        return self._parse_json_safely(raw_output)
+        Generates the JSON composition from the algebra string.
 
-    def _parse_json_safely(self, text):
+        Well-formed expressions are parsed directly; the LLM chain is only
+        run for input the parser rejects. Raises pydantic.ValidationError if
+        the LLM output does not match ComposerSchema.
         """
-        Cleans LLM output (removes markdown backticks) and parses JSON.
-        """
-        text = text.strip()
-        # Remove markdown code blocks if present
-        if text.startswith("```json"):
-            text = text[7:]
-        if text.startswith("```"):
-            text = text[3:]
-        if text.endswith("```"):
-            text = text[:-3]
-        
         try:
-            return json.loads(text)
-        except json.JSONDecodeError as e:
-            # Fallback for error handling in UI
-            return {
-                "original_expression": "Error parsing",
-                "schedule_logic": "Linear",
-                "score": [],
-                "math_narrative": f"Error: {str(e)}",
-                "raw_output": text
-            }
-
-    def format_latex_report(self, composition):
+            return parse_algebra(algebra_str)
+        except AlgebraSyntaxError:
+            pass
+
+        key = make_key(COMPOSER_SYSTEM_PROMPT, algebra_str, self.model_name, self.temperature)
+        return await ainvoke_cached(self.chain, {"algebra": algebra_str}, key, parse=self._parse_output)
+
+    @staticmethod
+    def _parse_output(text):
+        """Validates the LLM output against ComposerSchema and returns it as a dict."""
+        return ComposerSchema.model_validate_json(strip_code_fences(strip_think_tags(text))).model_dump()
+
+    @staticmethod
+    def format_latex_report(composition):
         """
         Generates a readable Markdown/LaTeX report from the JSON composition.
         """
@@ -120,19 +116,20 @@ class Composer:
         narrative = composition.get("math_narrative", "")
         freq = composition.get("global_frequency", 1.0)
         
-        report = f"### Cognitive Schedule: **{logic}**\n"
-        report += f"*{narrative}* (Global Accel: $\\omega={freq}$)\n\n"
-        
-        report += "| Function | Objective Class | Math Form | Mass ($m$) |\n"
-        report += "| :--- | :--- | :--- | :---: |\n"
+        parts = [
+            f"### Cognitive Schedule: **{logic}**\n",
+            f"*{narrative}* (Global Accel: $\\omega={freq}$)\n\n",
+            "| Function | Objective Class | Math Form | Mass ($m$) |\n",
+            "| :--- | :--- | :--- | :---: |\n",
+        ]
         
         score = composition.get("score", [])
         for track in score:
             # Escape pipes in latex for markdown table compatibility
             clean_formula = track['formula'].replace("|", "\\|")
-            report += f"| {track['voice']} | `{track['symbol']}` | ${clean_formula}$ | {track['mass']} |\n"
+            parts.append(f"| {track['voice']} | `{track['symbol']}` | ${clean_formula}$ | {track['mass']} |\n")
         
-        report += "\n**Intercalation Dynamics:**\n"
+        parts.append("\n**Intercalation Dynamics:**\n")
         
         # Generate the master equation based on logic
         terms = []
@@ -141,7 +138,7 @@ class Composer:
                 trig = "\\sin" if i % 2 == 0 else "\\cos"
                 terms.append(f"{track['mass']} \\cdot {trig}(\\omega t) \\cdot [{track['formula']}]")
             eq = " + ".join(terms)
-            report += f"$$ J(\\theta) = \\sum_{{t}} ({eq}) $$"
+            parts.append(f"$$ J(\\theta) = \\sum_{{t}} ({eq}) $$")
             
         elif logic == "Drag":
             # Logic: First term decays, others grow (or static)
@@ -151,7 +148,7 @@ class Composer:
                 for track in score[1:]:
                     terms.append(f"({track['mass']} \\cdot (1-e^{{-\\lambda t}})) \\cdot [{track['formula']}]")
             eq = " + ".join(terms)
-            report += f"$$ J(\\theta) = \\int ({eq}) dt $$"
+            parts.append(f"$$ J(\\theta) = \\int ({eq}) dt $$")
             
         elif logic == "Adversarial":
             # Logic: Subtract secondary terms from primary
@@ -160,12 +157,12 @@ class Composer:
                 for track in score[1:]:
                     terms.append(f" - {track['mass']} \\cdot [{track['formula']}]")
             eq = "".join(terms)
-            report += f"$$ J(\\theta) = \\max_\\pi ({eq}) $$"
+            parts.append(f"$$ J(\\theta) = \\max_\\pi ({eq}) $$")
             
         else: # Linear/Default
             for track in score:
                 terms.append(f"{track['mass']} \\cdot [{track['formula']}]")
             eq = " + ".join(terms)
-            report += f"$$ J(\\theta) = {eq} $$"
+            parts.append(f"$$ J(\\theta) = {eq} $$")
             
-        return report
\ No newline at end of file
+        return "".join(parts)
\ No newline at end of file
@@ -1,16 +1,55 @@
+import functools
+import importlib
+import itertools
+import logging
 import os
-from langchain_community.chat_models import ChatOllama
-from langchain_google_genai import ChatGoogleGenerativeAI
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Comma-separated Ollama servers, e.g. "http://gpu0:11434,http://gpu1:11434"
+OLLAMA_HOSTS = [host.strip() for host in os.getenv("OLLAMA_HOSTS", "").split(",") if host.strip()]
+_ollama_host_cycle = itertools.cycle(OLLAMA_HOSTS)
+_ollama_host_lock = threading.Lock()
+# How long Ollama keeps a model in VRAM after a request: a duration ("24h") or seconds (-1 = forever)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "24h")
+if OLLAMA_KEEP_ALIVE.lstrip("-").isdigit():
+    OLLAMA_KEEP_ALIVE = int(OLLAMA_KEEP_ALIVE)
+
+
+@functools.lru_cache(maxsize=None)
+def _load_chat_class(module_name, class_name):
+    """
+    Imports a chat model class on first use.
+
+    The backends pull in heavy dependency trees (grpc/protobuf for Gemini),
+    so each is only imported once a model from it is actually requested.
+    """
+    return getattr(importlib.import_module(module_name), class_name)
 
 class ModelFactory:
     @staticmethod
-    def get_model(model_name="llama3", temperature=0.7):
+    def next_ollama_host():
         """
-        Returns a ChatModel instance.
+        Returns the next server from OLLAMA_HOSTS in round-robin order,
+        or None (Ollama's default host) when it is not set.
+        """
+        if not OLLAMA_HOSTS:
+            return None
+        with _ollama_host_lock:
+            return next(_ollama_host_cycle)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=16)
+    def get_model(model_name="llama3", temperature=0.7, json_mode=False, base_url=None):
+        """
+        Returns a ChatModel instance, shared between callers asking for the same settings.
         - If model_name starts with 'gemini', returns ChatGoogleGenerativeAI.
         - Otherwise, defaults to ChatOllama.
+        - If json_mode is set, the backend is constrained to emit a JSON object.
+        - base_url selects the Ollama server; it is ignored for Gemini.
         """
-        print(f"Initializing Model: {model_name} (Temp: {temperature})")
+        logger.debug("Initializing Model: %s (Temp: %s)", model_name, temperature)
         
         if model_name.lower().startswith("gemini"):
             # Ensure GOOGLE_API_KEY is in your .env file
@@ -18,14 +57,23 @@ class ModelFactory:
             if not api_key:
                 raise ValueError("GEMINI_API_KEY not found in environment variables.")
                 
+            ChatGoogleGenerativeAI = _load_chat_class("langchain_google_genai", "ChatGoogleGenerativeAI")
+            extra = {"response_mime_type": "application/json"} if json_mode else {}
             return ChatGoogleGenerativeAI(
                 model=model_name,
                 temperature=temperature,
                 google_api_key=api_key,
-                convert_system_message_to_human=True # Helps with some system prompt restrictions
+                convert_system_message_to_human=True, # Helps with some system prompt restrictions
+                **extra
             )
         else:
+            ChatOllama = _load_chat_class("langchain_community.chat_models", "ChatOllama")
+            extra = {"format": "json"} if json_mode else {}
+            if base_url:
+                extra["base_url"] = base_url
             return ChatOllama(
                 model=model_name, 
-                temperature=temperature
+                temperature=temperature,
+                keep_alive=OLLAMA_KEEP_ALIVE, # Avoids reloading the model between requests
+                **extra
             )
\ No newline at end of file
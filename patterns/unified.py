@@ -0,0 +1,94 @@
+import re
+from langchain_core.prompts import ChatPromptTemplate
+from .algebra import ALGEBRA_SYSTEM_PROMPT
+from .cache import ainvoke_cached, make_key
+from .code import CODING_SYSTEM_PROMPT, CodeGenerator
+from .composition import COMPOSER_SYSTEM_PROMPT, ComposerSchema
+from .config import ModelFactory
+from .utils import strip_think_tags
+
+UNIFIED_SYSTEM_PROMPT = """
+You will perform three tasks in sequence, in a single response.
+Each task is described below. Where a task refers to its input, use the output of the previous task.
+
+## TASK 1: ALGEBRA
+""" + ALGEBRA_SYSTEM_PROMPT + """
+## TASK 2: JSON
+""" + COMPOSER_SYSTEM_PROMPT + """
+## TASK 3: CODE
+""" + CODING_SYSTEM_PROMPT + """
+## RESPONSE FORMAT:
+Ignore the per-task output rules above. Respond with exactly these three sections and nothing else:
+
+### SECTION 1: ALGEBRA
+<the algebraic expression from Task 1>
+### SECTION 2: JSON
+<the JSON object from Task 2>
+### SECTION 3: CODE
+<the Python code from Task 3>
+"""
+
+# The exact headers from RESPONSE FORMAT, in the order they must appear
+_SECTION_HEADERS = [
+    re.compile(rf"^### SECTION {n}: {name}[ \t]*$", re.MULTILINE)
+    for n, name in ((1, "ALGEBRA"), (2, "JSON"), (3, "CODE"))
+]
+
+
+class UnifiedAnalyst:
+    """
+    Runs Layers 1-3 in a single LLM call.
+
+    Saves two round trips and two copies of the system prompts, which
+    dominates the cost on short inputs. Only use it with models whose
+    context window fits the merged prompt.
+    """
+
+    def __init__(self, model_name="llama3", base_url=None):
+        self.model_name = model_name
+        self.temperature = 0.8
+        self.llm = ModelFactory.get_model(model_name=model_name, temperature=self.temperature, base_url=base_url)
+        self.prompt = ChatPromptTemplate.from_messages([
+            ("system", UNIFIED_SYSTEM_PROMPT),
+            ("human", "Text: {text}")
+        ])
+        self.chain = self.prompt | self.llm
+
+    async def analyze(self, text):
+        """
+        Returns (algebraic_expr, composition, code) for the input text.
+        Raises ValueError if a section is missing from the response.
+        """
+        key = make_key(UNIFIED_SYSTEM_PROMPT, text, self.model_name, self.temperature)
+        return await ainvoke_cached(
+            self.chain, {"text": text}, key, parse=lambda raw: self._parse_sections(strip_think_tags(raw))
+        )
+
+    def _parse_sections(self, text):
+        """Splits the response on its section headers and parses each section."""
+        # First match of each header, in order; everything after SECTION 3 is
+        # code, so a "# Section 1:" comment inside it can't re-split the reply.
+        bounds = []
+        pos = 0
+        for n, header in enumerate(_SECTION_HEADERS, start=1):
+            match = header.search(text, pos)
+            if not match:
+                raise ValueError(f"Unified response is missing section {n}")
+            bounds.append((match.start(), match.end()))
+            pos = match.end()
+        sections = {
+            "1": text[bounds[0][1]:bounds[1][0]],
+            "2": text[bounds[1][1]:bounds[2][0]],
+            "3": text[bounds[2][1]:],
+        }
+
+        algebraic_expr = sections["1"].strip().strip("`").strip()
+
+        body = sections["2"]
+        start, end = body.find("{"), body.rfind("}")
+        if start == -1 or end == -1:
+            raise ValueError("Unified response has no JSON object in section 2")
+        composition = ComposerSchema.model_validate_json(body[start:end + 1]).model_dump()
+
+        code = CodeGenerator._clean_output(sections["3"])
+        return algebraic_expr, composition, code
@@ -0,0 +1,46 @@
+import re
+
+_THINK_RE = re.compile(r"<think>.*?</think>", re.DOTALL)
+# Optional opening fence (with language tag) and optional closing fence around the content.
+# Matched against stripped text so the end check is a fixed-length lookup, not a whitespace rescan.
+_FENCE_RE = re.compile(r"(?:```\w*[ \t]*\n?)?(.*?)\n?(?:```)?\Z", re.DOTALL)
+
+
+def strip_think_tags(text: str, streaming: bool = False) -> str:
+    """
+    Removes <think>...</think> tags and their content from a string.
+
+    Args:
+        text: The input string that may contain think tags.
+        streaming: Set for partial output still being generated. A trailing
+            <think> block whose closing tag has not arrived yet is removed
+            too, including a partially received opening tag ("<t" to "<think").
+
+    Returns:
+        A new string with all think tags and their inner content removed.
+    """
+    if not text: return ""
+    text = _THINK_RE.sub("", text)
+    if streaming:
+        start = text.find("<think>")
+        if start != -1:
+            return text[:start]
+        for size in range(len("<think>") - 1, 1, -1):
+            if text.endswith("<think>"[:size]):
+                return text[:-size]
+    return text
+
+
+def strip_code_fences(text: str) -> str:
+    """
+    Removes a surrounding markdown code fence, e.g. ```python ... ```, in one pass.
+
+    Args:
+        text: LLM output that may be wrapped in a code fence. An unclosed
+            opening fence, as seen mid-stream, is removed as well.
+
+    Returns:
+        The content inside the fence, stripped of surrounding whitespace.
+    """
+    if not text: return ""
+    return _FENCE_RE.match(text.strip()).group(1).strip()